@@ -1,13 +1,17 @@
 import os
-import json
 import time
+import random
 import asyncio
 import datetime as dt
 import logging
+import functools
+import operator
 from zoneinfo import ZoneInfo
 from pathlib import Path
+from typing import Any, Optional
 
-import requests
+import orjson
+import httpx
 from dotenv import load_dotenv
 import genshin
 import warnings
@@ -89,15 +93,22 @@ if errors:
 # run cadence (hours) – default 1 hour
 SCHEDULE_HOURS = int(os.getenv("SCHEDULE_HOURS", "1"))
 POST_ON_START = os.getenv("POST_ON_START", "true").lower() in ("1", "true", "yes")
+# re-post unchanged Daily Notes at most this often (0 = post every cycle)
+REPOST_UNCHANGED_HOURS = float(os.getenv("REPOST_UNCHANGED_HOURS", "6"))
+# first retry delay after a failed cycle; doubles per failure up to the schedule
+RETRY_MIN_SECONDS = 30
 
-# resin alert thresholds (once per day per threshold)
-RESIN_ALERTS = [
+# resin alert thresholds (once per day per threshold), ascending and de-duplicated
+RESIN_ALERTS = tuple(sorted({
     int(x) for x in os.getenv("RESIN_ALERT_THRESHOLDS", "120,160").split(",") if x.strip()
-]
+}))
 
 # simple state persistence
 DATA_DIR = os.getenv("DATA_DIR", "/data")
 STATE_PATH = os.path.join(DATA_DIR, "state.json")
+# alert events are appended here and folded into state.json on compaction
+STATE_JOURNAL_PATH = os.path.join(DATA_DIR, "state.journal")
+JOURNAL_COMPACT_BYTES = 1024
 
 # Abyss reset is tied to NA server (04:00 America/New_York on 1st & 16th)
 NA_TZ = ZoneInfo("America/New_York")
@@ -111,39 +122,116 @@ def _ensure_dir(p: str):
     except Exception:
         pass
 
+# DATA_DIR is fixed for the process; create it once instead of per read/write
+_ensure_dir(DATA_DIR)
+
+# Alert flags only matter for the current NA day; keep one spare around midnight
+RESIN_ALERT_DAYS_KEPT = 2
+
+def prune_resin_alerts(state: dict):
+    """Drop all but the most recent resin-alert days so state.json stays bounded."""
+    days = state.get("resin_alerts")
+    if not days or len(days) <= RESIN_ALERT_DAYS_KEPT:
+        return
+    # Day keys are YYYY-MM-DD, so lexical order is chronological
+    keep = sorted(days)[-RESIN_ALERT_DAYS_KEPT:]
+    state["resin_alerts"] = {k: days[k] for k in keep}
+    mark_state_dirty()
+
+def _replay_journal(state: dict):
+    try:
+        f = open(STATE_JOURNAL_PATH, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Torn last line from a crash mid-append; skip it
+                continue
+            state.setdefault("resin_alerts", {}).setdefault(entry["d"], {})[entry["t"]] = True
+
 def load_state() -> dict:
-    _ensure_dir(DATA_DIR)
-    if not os.path.exists(STATE_PATH):
-        return {}
+    """Snapshot from state.json with any journaled alerts replayed on top."""
     try:
-        with open(STATE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(STATE_PATH, "rb") as f:
+            state = orjson.loads(f.read())
+    except FileNotFoundError:
+        state = {}
     except Exception:
-        return {}
+        # Unreadable snapshot; start fresh rather than fail the cycle
+        state = {}
+    try:
+        _replay_journal(state)
+    except Exception:
+        pass
+    prune_resin_alerts(state)
+    return state
 
 def save_state(state: dict):
-    _ensure_dir(DATA_DIR)
     tmp = STATE_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
     os.replace(tmp, STATE_PATH)
 
-def today_na_str() -> str:
-    return dt.datetime.now(NA_TZ).strftime("%Y-%m-%d")
+def append_alert(day: str, k: str):
+    """Record a fired threshold as one journal line instead of rewriting state.json."""
+    with open(STATE_JOURNAL_PATH, "ab") as f:
+        f.write(orjson.dumps({"d": day, "t": k}) + b"\n")
 
-def post_slack_text(text: str):
-    if not SLACK_WEBHOOK_URL:
-        raise RuntimeError("Missing SLACK_WEBHOOK_URL")
-    r = requests.post(SLACK_WEBHOOK_URL, json={"text": text}, timeout=20)
-    r.raise_for_status()
+# Set by state mutators that aren't journaled (e.g. pruning)
+_state_dirty = False
 
-def post_slack_blocks(blocks: list, fallback: str = "Update"):
+def mark_state_dirty():
+    global _state_dirty
+    _state_dirty = True
+
+def compact_state(state: dict):
+    """Write the full snapshot and drop the journal it now contains."""
+    global _state_dirty
+    save_state(state)
+    try:
+        os.remove(STATE_JOURNAL_PATH)
+    except FileNotFoundError:
+        pass
+    _state_dirty = False
+
+def flush_state_if_dirty(state: dict):
+    try:
+        journal_size = os.path.getsize(STATE_JOURNAL_PATH)
+    except OSError:
+        journal_size = 0
+    if _state_dirty or journal_size > JOURNAL_COMPACT_BYTES:
+        compact_state(state)
+
+def today_na_str(now_na: Optional[dt.datetime] = None) -> str:
+    return (now_na or dt.datetime.now(NA_TZ)).strftime("%Y-%m-%d")
+
+# One long-lived HTTP/2 client for the webhook host; concurrent posts in a
+# cycle multiplex over a single kept-alive connection. Closed by serve().
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=20,
+    limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+)
+
+async def _post_slack(payload: dict):
     if not SLACK_WEBHOOK_URL:
         raise RuntimeError("Missing SLACK_WEBHOOK_URL")
-    payload = {"blocks": blocks, "text": fallback}
-    r = requests.post(SLACK_WEBHOOK_URL, json=payload, timeout=20)
+    r = await _http.post(
+        SLACK_WEBHOOK_URL,
+        content=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+    )
     r.raise_for_status()
 
+async def post_slack_text(text: str):
+    await _post_slack({"text": text})
+
+async def post_slack_blocks(blocks: list, fallback: str = "Update"):
+    await _post_slack({"blocks": blocks, "text": fallback})
+
 # ──────────────────────────────────────────────────────────────────────────────
 # TIME HELPERS
 # ──────────────────────────────────────────────────────────────────────────────
@@ -179,32 +267,56 @@ def eta_str(seconds) -> str:
     if seconds <= 0:
         return "ready"
     h, rem = divmod(seconds, 3600)
-    m, _ = divmod(rem, 60)
-    return "in ~" + ("{}h ".format(h) if h else "") + ("{}m".format(m) if m else "").strip()
-
-def next_abyss_reset_na():
-    """Abyss resets on the 1st & 16th at 04:00 NA server time."""
-    now = dt.datetime.now(NA_TZ)
+    m = rem // 60
+    if h and m:
+        return f"in ~{h}h {m}m"
+    if h:
+        return f"in ~{h}h"
+    return f"in ~{m}m"
+
+def _compute_next_abyss_reset(now: dt.datetime) -> dt.datetime:
     y, m, d = now.year, now.month, now.day
 
     if d < 1 or (d == 1 and now.hour < 4):
-        target = dt.datetime(y, m, 1, 4, 0, tzinfo=NA_TZ)
-    elif d < 16 or (d == 16 and now.hour < 4):
-        target = dt.datetime(y, m, 16, 4, 0, tzinfo=NA_TZ)
+        return dt.datetime(y, m, 1, 4, 0, tzinfo=NA_TZ)
+    if d < 16 or (d == 16 and now.hour < 4):
+        return dt.datetime(y, m, 16, 4, 0, tzinfo=NA_TZ)
+    if m == 12:
+        y2, m2 = y + 1, 1
     else:
-        if m == 12:
-            y2, m2 = y + 1, 1
-        else:
-            y2, m2 = y, m + 1
-        target = dt.datetime(y2, m2, 1, 4, 0, tzinfo=NA_TZ)
-    return target, target - now
+        y2, m2 = y, m + 1
+    return dt.datetime(y2, m2, 1, 4, 0, tzinfo=NA_TZ)
+
+# Next reset only changes twice a month; recompute once it has passed
+_abyss_reset_cache: Optional[dt.datetime] = None
+
+def next_abyss_reset_na(now_na: Optional[dt.datetime] = None):
+    """Abyss resets on the 1st & 16th at 04:00 NA server time."""
+    global _abyss_reset_cache
+    now = now_na or dt.datetime.now(NA_TZ)
+    if _abyss_reset_cache is None or now >= _abyss_reset_cache:
+        _abyss_reset_cache = _compute_next_abyss_reset(now)
+    return _abyss_reset_cache, _abyss_reset_cache - now
 
 # ──────────────────────────────────────────────────────────────────────────────
 # FEATURES
 # ──────────────────────────────────────────────────────────────────────────────
-def maybe_fire_resin_alerts(resin_now: int, state: dict):
+_RESIN_MSG = "🔔 *Resin Alert*: You’ve reached **{}** resin (current: {}).".format
+
+async def _send_resin_alert(day_key: str, day_alerts: dict, k: str, text: str):
+    try:
+        await post_slack_text(text)
+    except Exception:
+        # Un-mark so the threshold is retried next cycle
+        day_alerts.pop(k, None)
+        raise
+    append_alert(day_key, k)
+
+def maybe_fire_resin_alerts(resin_now: int, state: dict, now_na: Optional[dt.datetime] = None) -> list:
     """
-    Fire per-day resin alerts once per threshold.
+    Schedule per-day resin alerts once per threshold and return the posting tasks.
+    Thresholds are marked in memory up front (and un-marked if the post fails);
+    each successful post is appended to the state journal.
     State shape:
     {
       "resin_alerts": {
@@ -215,128 +327,227 @@ def maybe_fire_resin_alerts(resin_now: int, state: dict):
       }
     }
     """
-    day_key = today_na_str()
+    day_key = today_na_str(now_na)
     state.setdefault("resin_alerts", {})
-    state["resin_alerts"].setdefault(day_key, {})
-    fired_any = False
+    day_alerts = state["resin_alerts"].setdefault(day_key, {})
+    prune_resin_alerts(state)
+    pending = []
 
     for thr in RESIN_ALERTS:
+        if resin_now < thr:
+            # Thresholds are ascending, so none of the rest can fire either
+            break
         k = str(thr)
-        already = state["resin_alerts"][day_key].get(k, False)
-        if not already and resin_now >= thr:
-            post_slack_text(f"🔔 *Resin Alert*: You’ve reached **{thr}** resin (current: {resin_now}).")
-            state["resin_alerts"][day_key][k] = True
-            fired_any = True
+        if not day_alerts.get(k, False):
+            day_alerts[k] = True
+            text = _RESIN_MSG(thr, resin_now)
+            pending.append(asyncio.create_task(_send_resin_alert(day_key, day_alerts, k, text)))
+
+    return pending
 
-    if fired_any:
-        save_state(state)
+# ──────────────────────────────────────────────────────────────────────────────
+# SLACK BLOCKS
+# ──────────────────────────────────────────────────────────────────────────────
+# Static scaffold for the Daily Notes post, built once; per cycle only the
+# mrkdwn field texts and the timestamp change. Shared dicts are never mutated.
+_RESIN_FMT = "*🔋 Resin*\n`{}/{}` — {} to full"
+_EXPEDITIONS_FMT = "*🗺 Expeditions*\n`{}/{}` finished"
+_TEAPOT_FMT = "*🫖 Teapot Coins*\n`{}/{}` — {} to cap"
+_TEAPOT_NA = "*🫖 Teapot Coins*\n`N/A`"
+_ABYSS_FMT = "*🌙 Abyss Reset (NA)*\n`{}` — in {}"
+_COMMISSIONS_FMT = "*📝 Commissions*\n`{}/{}`"
+_REWARD_CLAIMED = "*🎁 Commission Reward*\n✅ claimed"
+_REWARD_UNCLAIMED = "*🎁 Commission Reward*\n❌ not claimed"
+
+_SERVER_ELEMENT = {"type": "mrkdwn", "text": "*Server:* NA"}
+_DIVIDER_BLOCK = {"type": "divider"}
+
+@functools.lru_cache(maxsize=None)
+def _uid_blocks(uid: int) -> tuple:
+    """Header block and UID context element; constant per UID."""
+    header = {
+        "type": "header",
+        "text": {
+            "type": "plain_text",
+            "text": f"Genshin Daily Notes — {uid}",
+            "emoji": True,
+        },
+    }
+    return header, {"type": "mrkdwn", "text": f"*UID:* `{uid}`"}
+
+def notes_blocks(uid: int, now_utc: str, field_texts: list) -> list:
+    header, uid_element = _uid_blocks(uid)
+    return [
+        header,
+        {
+            "type": "context",
+            "elements": [
+                {"type": "mrkdwn", "text": f"*Time:* {now_utc}"},
+                _SERVER_ELEMENT,
+                uid_element,
+            ],
+        },
+        _DIVIDER_BLOCK,
+        {"type": "section", "fields": [{"type": "mrkdwn", "text": t} for t in field_texts]},
+    ]
+
+# uid -> (notes key, monotonic time) of the last Daily Notes post that went out
+_last_notes_post: dict[int, tuple[tuple, float]] = {}
+
+def notes_unchanged(uid: int, key: tuple) -> bool:
+    """True if this UID's last post showed the same values within REPOST_UNCHANGED_HOURS."""
+    last = _last_notes_post.get(uid)
+    if last is None or last[0] != key:
+        return False
+    return time.monotonic() - last[1] < REPOST_UNCHANGED_HOURS * 3600
+
+async def _post_notes(uid: int, key: tuple, blocks: list):
+    await post_slack_blocks(blocks, fallback=f"Genshin Daily Notes ({uid})")
+    _last_notes_post[uid] = (key, time.monotonic())
 
 # ──────────────────────────────────────────────────────────────────────────────
 # MAIN CYCLE
 # ──────────────────────────────────────────────────────────────────────────────
+_expedition_finished = operator.attrgetter("finished")
+
+_genshin_client: Optional[genshin.Client] = None
+
+def _get_client() -> genshin.Client:
+    """Build the HoYoLab client once and reuse it across cycles."""
+    global _genshin_client
+    if _genshin_client is None:
+        _genshin_client = genshin.Client(cookies={"ltoken_v2": LTOKEN_V2, "ltuid_v2": LTUID_V2})
+    return _genshin_client
+
+# Notes barely move minute to minute (resin regens 1 per 8 min), so a short
+# TTL plus one shared in-flight fetch per UID avoids redundant HoYoLab calls
+NOTES_CACHE_SECONDS = 60
+_notes_cache: dict[int, tuple[float, Any]] = {}
+_notes_inflight: dict[int, asyncio.Task] = {}
+
+async def get_notes(uid: int):
+    cached = _notes_cache.get(uid)
+    if cached and time.monotonic() - cached[0] < NOTES_CACHE_SECONDS:
+        return cached[1]
+
+    task = _notes_inflight.get(uid)
+    if task is None:
+        task = asyncio.create_task(_get_client().get_genshin_notes(uid))
+        _notes_inflight[uid] = task
+    started = time.monotonic()
+    try:
+        notes = await task
+    finally:
+        if _notes_inflight.get(uid) is task:
+            del _notes_inflight[uid]
+    _notes_cache[uid] = (started, notes)
+    return notes
+
 async def run_once():
     state = load_state()
-    client = genshin.Client(cookies={"ltoken_v2": LTOKEN_V2, "ltuid_v2": LTUID_V2})
-
-    for uid in GENSHIN_UIDS:
-        # Daily Notes for this UID
-        notes = await client.get_genshin_notes(uid)
-
-        # Resin
-        resin_now = notes.current_resin
-        resin_max = notes.max_resin
-        resin_eta = convert_recovery(notes.resin_recovery_time)
-
-        # Alerts
-        maybe_fire_resin_alerts(resin_now, state)
-
-        # Commissions
-        commissions_done = getattr(notes, "finished_commissions", 0) or 0
-        commissions_total = getattr(notes, "max_commissions", 4) or 4
-        commissions_claimed = bool(getattr(notes, "claimed_commission_reward", False))
-
-        # Expeditions
-        expeditions = notes.expeditions or []
-        exp_finished = sum(1 for e in expeditions if getattr(e, "finished", False))
-        exp_total = len(expeditions)
-
-        # Teapot
-        realm_currency = getattr(notes, "current_realm_currency", None)
-        realm_max = getattr(notes, "max_realm_currency", None)
-        realm_eta = convert_recovery(getattr(notes, "realm_currency_recovery_time", None))
-
-        # Abyss
-        abyss_target, abyss_delta = next_abyss_reset_na()
-        abyss_eta = eta_str(int(abyss_delta.total_seconds())).replace("in ~", "")
-
-        # Timestamp (UTC)
-        now_utc = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
-
-        # Slack Blocks (no check-in, no transformer, no character summary)
-        fields = [
-            {
-                "type": "mrkdwn",
-                "text": f"*🔋 Resin*\n`{resin_now}/{resin_max}` — {eta_str(resin_eta)} to full",
-            },
-            {
-                "type": "mrkdwn",
-                "text": f"*🗺 Expeditions*\n`{exp_finished}/{exp_total}` finished",
-            },
-            {
-                "type": "mrkdwn",
-                "text": (
-                    f"*🫖 Teapot Coins*\n`{realm_currency}/{realm_max}` — {eta_str(realm_eta)} to cap"
+
+    # One clock reading per cycle; NA time is derived from it
+    now = dt.datetime.now(dt.timezone.utc)
+    now_na = now.astimezone(NA_TZ)
+    now_utc = now.strftime("%Y-%m-%d %H:%M UTC")
+    alert_posts = []
+    pending_posts = []
+
+    try:
+        for uid in GENSHIN_UIDS:
+            # Daily Notes for this UID
+            notes = await get_notes(uid)
+
+            # Resin
+            resin_now = notes.current_resin
+            resin_max = notes.max_resin
+            resin_eta = convert_recovery(notes.resin_recovery_time)
+
+            # Alerts
+            alert_posts += maybe_fire_resin_alerts(resin_now, state, now_na)
+
+            # Commissions
+            commissions_done = notes.completed_commissions or 0
+            commissions_total = notes.max_commissions or 4
+            commissions_claimed = bool(notes.claimed_commission_reward)
+
+            # Expeditions
+            expeditions = notes.expeditions or []
+            exp_finished = sum(map(_expedition_finished, expeditions))
+            exp_total = len(expeditions)
+
+            # Teapot
+            realm_currency = notes.current_realm_currency
+            realm_max = notes.max_realm_currency
+            realm_eta = convert_recovery(notes.realm_currency_recovery_time)
+
+            # Abyss
+            abyss_target, abyss_delta = next_abyss_reset_na(now_na)
+            abyss_eta = eta_str(int(abyss_delta.total_seconds())).replace("in ~", "")
+
+            # Skip the post if nothing visible changed since the last one
+            notes_key = (resin_now, exp_finished, exp_total, realm_currency, commissions_done, commissions_claimed)
+            if notes_unchanged(uid, notes_key):
+                continue
+
+            # Slack Blocks (no check-in, no transformer, no character summary)
+            blocks = notes_blocks(uid, now_utc, [
+                _RESIN_FMT.format(resin_now, resin_max, eta_str(resin_eta)),
+                _EXPEDITIONS_FMT.format(exp_finished, exp_total),
+                (
+                    _TEAPOT_FMT.format(realm_currency, realm_max, eta_str(realm_eta))
                     if realm_currency is not None
-                    else "*🫖 Teapot Coins*\n`N/A`"
+                    else _TEAPOT_NA
                 ),
-            },
-            {
-                "type": "mrkdwn",
-                "text": f"*🌙 Abyss Reset (NA)*\n`{abyss_target.strftime('%Y-%m-%d %H:%M %Z')}` — in {abyss_eta}",
-            },
-            {
-                "type": "mrkdwn",
-                "text": f"*📝 Commissions*\n`{commissions_done}/{commissions_total}`",
-            },
-            {
-                "type": "mrkdwn",
-                "text": f"*🎁 Commission Reward*\n{'✅ claimed' if commissions_claimed else '❌ not claimed'}",
-            },
-        ]
-
-        blocks = [
-            {
-                "type": "header",
-                "text": {
-                    "type": "plain_text",
-                    "text": f"Genshin Daily Notes — {uid}",
-                    "emoji": True,
-                },
-            },
-            {
-                "type": "context",
-                "elements": [
-                    {"type": "mrkdwn", "text": f"*Time:* {now_utc}"},
-                    {"type": "mrkdwn", "text": "*Server:* NA"},
-                    {"type": "mrkdwn", "text": f"*UID:* `{uid}`"},
-                ],
-            },
-            {"type": "divider"},
-            {"type": "section", "fields": fields},
-        ]
-
-        post_slack_blocks(blocks, fallback=f"Genshin Daily Notes ({uid})")
+                _ABYSS_FMT.format(abyss_target.strftime("%Y-%m-%d %H:%M %Z"), abyss_eta),
+                _COMMISSIONS_FMT.format(commissions_done, commissions_total),
+                _REWARD_CLAIMED if commissions_claimed else _REWARD_UNCLAIMED,
+            ])
+
+            pending_posts.append(asyncio.create_task(_post_notes(uid, notes_key, blocks)))
+    finally:
+        # Wait for every Slack send; one failed post shouldn't drop the others
+        results = await asyncio.gather(*alert_posts, *pending_posts, return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                print(f"[ERROR] Slack post failed: {res}", flush=True)
+
+        flush_state_if_dirty(state)
+
+async def scheduler():
+    # Fold any journal left from the previous run into the snapshot
+    try:
+        compact_state(load_state())
+    except Exception as e:
+        print(f"[ERROR] state compaction failed: {e}", flush=True)
 
-def main_loop():
-    if POST_ON_START:
-        asyncio.run(run_once())
+    period = max(1, SCHEDULE_HOURS * 3600)
+    if not POST_ON_START:
+        await asyncio.sleep(period)
 
+    fail_count = 0
     while True:
         try:
-            time.sleep(max(1, SCHEDULE_HOURS * 3600))
-            asyncio.run(run_once())
+            await run_once()
+            fail_count = 0
+            delay = period
         except Exception as e:
-            print(f"[ERROR] {e}", flush=True)
+            # Transient failures (rate limits, DNS) usually clear well before
+            # the next scheduled run, so retry sooner with jittered backoff
+            delay = min(period, RETRY_MIN_SECONDS * 2 ** min(fail_count, 6)) + random.uniform(0, 10)
+            fail_count += 1
+            print(f"[ERROR] {e} (retrying in {int(delay)}s)", flush=True)
+        await asyncio.sleep(delay)
+
+async def serve():
+    try:
+        await scheduler()
+    finally:
+        await _http.aclose()
+
+def main_loop():
+    # One long-lived event loop so pooled connections survive between cycles
+    asyncio.run(serve())
 
 if __name__ == "__main__":
     main_loop()
\ No newline at end of file